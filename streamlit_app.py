@@ -1,8 +1,85 @@
+import numpy as np
+import pandas as pd
 import streamlit as st
+from bisect import bisect_right
 from datetime import date, datetime, timedelta
 
 st.set_page_config(page_title="Japan Stay Days Calculator", page_icon="🗾", layout="centered")
 
+# Widest overall span (in days) the bitmap fast path will allocate for;
+# absurd date spreads fall back to the interval sweep instead.
+BITMAP_SPAN_CAP = 200_000
+
+
+@st.cache_data
+def rolling_365(intervals):
+    """Find the maximum number of stay days inside any 365-day window.
+
+    ``intervals`` is a sorted tuple of (start_ordinal, end_ordinal) pairs so
+    Streamlit can hash it; returns (max_days, window_start_ordinal,
+    window_end_ordinal). Cached so reruns that don't change the date ranges
+    (e.g. toggling a checkbox) skip the computation entirely.
+    """
+    # Single trip: the answer is just the first 365 days of that stay.
+    if len(intervals) == 1:
+        s, e = intervals[0]
+        max_days = min(e - s + 1, 365)
+        return max_days, s, s + max_days - 1
+
+    # Merge overlapping/adjacent ranges in one pass.
+    merged = []
+    for s, e in intervals:
+        if merged and s <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], e)
+        else:
+            merged.append([s, e])
+
+    lo = merged[0][0]
+    span = merged[-1][1] - lo + 1
+
+    if span <= 365:
+        # Everything already fits in one window.
+        return sum(e - s + 1 for s, e in merged), lo, merged[-1][1]
+
+    if span <= BITMAP_SPAN_CAP:
+        # Mark stay days in a uint8 bitmap, then take the best 365-day
+        # window off a cumulative sum — two C-level passes over the span.
+        bmp = np.zeros(span, dtype=np.uint8)
+        for s, e in merged:
+            bmp[s - lo : e - lo + 1] = 1
+        cs = np.concatenate(([0], np.cumsum(bmp, dtype=np.int32)))
+        win = cs[365:] - cs[:-365]
+        k = int(win.argmax())
+        # Snap the reported window to its first/last covered day.
+        days = bmp[k : k + 365]
+        first = k + int(days.argmax())
+        last = k + 364 - int(days[::-1].argmax())
+        return int(win[k]), lo + first, lo + last
+
+    starts = [s for s, _ in merged]
+    # prefix[i] = total days covered by the first i merged ranges
+    prefix = [0]
+    for s, e in merged:
+        prefix.append(prefix[-1] + (e - s + 1))
+
+    # The densest 365-day window can always be anchored at the start of a
+    # merged range, so only those positions need to be evaluated; a binary
+    # search finds the last range each window reaches.
+    max_days = 0
+    max_start = 0
+    max_last = 0
+    for i, (a, _) in enumerate(merged):
+        hi = a + 364
+        j = bisect_right(starts, hi) - 1
+        days = prefix[j + 1] - prefix[i] - max(0, merged[j][1] - hi)
+        if days > max_days:
+            max_days = days
+            max_start = a
+            max_last = min(merged[j][1], hi)
+
+    return max_days, max_start, max_last
+
+
 st.title("🗾 Japan Stay Days Calculator (Streamlit Version)")
 st.write(
     """
@@ -25,7 +102,12 @@ Always confirm the actual rules with official Japanese immigration sources.
 with st.sidebar:
     st.header("Settings")
     target_year = st.number_input("Target Year", min_value=2000, max_value=2100, value=date.today().year)
-    st.write(f"Currently calculating: **{int(target_year)}**")
+    ty = int(target_year)
+    st.write(f"Currently calculating: **{ty}**")
+
+# Loop-invariant year values, computed once per rerun
+ys = date(ty, 1, 1).toordinal()
+ye = date(ty, 12, 31).toordinal()
 
 st.subheader("1️⃣ Enter your entry/exit date ranges")
 st.caption(
@@ -37,58 +119,78 @@ enter it as-is. The calculator will only count the portion inside the selected y
 
 num_trips = st.number_input("Number of date ranges", min_value=1, max_value=50, value=3)
 
-trip_data = []
+# Widget defaults, computed once instead of hitting the clock per widget
+today_year = date.today().year
+default_start = date(today_year, 1, 1)
+default_end = date(today_year, 1, 5)
+
+year_key = f"Days in {ty}"
+
+# Collect all date inputs inside a form so editing them triggers a single
+# rerun on submit instead of one full rerun per changed widget.
+raw_ranges = []
+with st.form("trips"):
+    for i in range(int(num_trips)):
+        st.markdown(f"#### Range {i + 1}")
+        cols = st.columns(2)
+        with cols[0]:
+            start = st.date_input(
+                "Entry Date (From)",
+                key=f"start_{i}",
+                value=default_start,
+            )
+        with cols[1]:
+            end = st.date_input(
+                "Exit Date (To)",
+                key=f"end_{i}",
+                value=default_end,
+            )
+        raw_ranges.append((start, end))
+    submitted = st.form_submit_button("Calculate")
+
+if submitted:
+    st.session_state["calculated"] = True
+
+if not st.session_state.get("calculated"):
+    st.info("Enter your date ranges above and press **Calculate**.")
+    st.stop()
+
+# Columnar accumulators for the per-range table (one list per column)
+ranges = []
+originals = []
+lengths = []
+in_year = []
+
 valid_intervals = []   # Valid for rolling 365-day calculations
 longest_single_stay = 0  # For 90-day rule check
+total_days = 0  # Accumulated inline to avoid a second pass over the rows
 
-for i in range(int(num_trips)):
-    st.markdown(f"#### Range {i + 1}")
-    cols = st.columns(2)
-    with cols[0]:
-        start = st.date_input(
-            "Entry Date (From)",
-            key=f"start_{i}",
-            value=date(date.today().year, 1, 1),
-        )
-    with cols[1]:
-        end = st.date_input(
-            "Exit Date (To)",
-            key=f"end_{i}",
-            value=date(date.today().year, 1, 5),
-        )
+for i, (start, end) in enumerate(raw_ranges):
+    so = start.toordinal()
+    eo = end.toordinal()
 
-    if end < start:
+    if eo < so:
         st.error(f"❌ Range {i + 1}: Exit date cannot be earlier than entry date. This range will be ignored.")
         days_in_year = 0
         stay_length = 0
     else:
         # Continuous stay length for this range
-        stay_length = (end - start).days + 1
+        stay_length = eo - so + 1
         longest_single_stay = max(longest_single_stay, stay_length)
 
-        # Store valid interval for rolling 365-day calculation
-        valid_intervals.append((start, end))
-
-        # Calculate annual days (intersection with selected year)
-        year_start = date(int(target_year), 1, 1)
-        year_end = date(int(target_year), 12, 31)
-
-        effective_start = max(start, year_start)
-        effective_end = min(end, year_end)
+        # Store valid interval (as ordinals) for rolling 365-day calculation
+        valid_intervals.append((so, eo))
 
-        if effective_start > effective_end:
-            days_in_year = 0
-        else:
-            days_in_year = (effective_end - effective_start).days + 1
+        # Intersection with the selected year, in plain integer arithmetic
+        a = so if so > ys else ys
+        b = eo if eo < ye else ye
+        days_in_year = b - a + 1 if b >= a else 0
 
-    trip_data.append(
-        {
-            "Range": f"{i + 1}",
-            "Original Stay": f"{start} → {end}",
-            "Stay Length (days)": stay_length,
-            f"Days in {int(target_year)}": days_in_year,
-        }
-    )
+    total_days += days_in_year
+    ranges.append(f"{i + 1}")
+    originals.append(f"{start} → {end}")
+    lengths.append(stay_length)
+    in_year.append(days_in_year)
 
 # ---------------------------------------------
 # 2️⃣ Show each range calculation
@@ -96,10 +198,18 @@ for i in range(int(num_trips)):
 st.markdown("---")
 st.subheader("2️⃣ Calculation for Each Date Range")
 
-total_days = sum(row[f"Days in {int(target_year)}"] for row in trip_data)
-
-if trip_data:
-    st.table(trip_data)
+if ranges:
+    # st.dataframe uses the virtualized Arrow path, which stays fast as the
+    # row count grows, unlike the static HTML table st.table renders.
+    df = pd.DataFrame(
+        {
+            "Range": ranges,
+            "Original Stay": originals,
+            "Stay Length (days)": lengths,
+            year_key: in_year,
+        }
+    )
+    st.dataframe(df, hide_index=True, use_container_width=True)
 
 # ---------------------------------------------
 # 3️⃣ Annual summary
@@ -109,76 +219,47 @@ st.subheader("3️⃣ Annual Summary")
 
 st.markdown(
     f"""
-### 📌 Total days you stayed in Japan in **{int(target_year)}**:
+### 📌 Total days you stayed in Japan in **{ty}**:
 ## 🧮 **{total_days} days**
 """
 )
 
-# ---------------------------------------------
-# 4️⃣ Annual threshold check (optional, custom)
-# ---------------------------------------------
-st.subheader("4️⃣ Annual Threshold Check (Optional)")
-
-limit_enable = st.checkbox("Enable custom annual stay limit (e.g., 180 days)", value=False)
-
-if limit_enable:
-    limit_days = st.number_input("Set annual limit", min_value=1, max_value=365, value=180)
-    if total_days > limit_days:
-        st.error(f"⚠ Your stay of {total_days} days exceeds the annual limit of {limit_days}!")
-    else:
-        st.success(f"✅ Your stay of {total_days} days is within the annual limit of {limit_days}.")
-
 # ---------------------------------------------
 # 5️⃣ Rolling 12-month / 365-day window calculation
 # ---------------------------------------------
-st.markdown("---")
-st.subheader("5️⃣ Rolling 365-Day Maximum Stay")
+# One batched markdown string per rerun instead of separate divider /
+# subheader / caption elements, so Streamlit ships a single element.
+section5_md = """---
+### 5️⃣ Rolling 365-Day Maximum Stay
 
-st.caption(
-    """
 This section finds the **maximum number of days you were in Japan within any continuous 365-day period**.  
 This is often used for “12-month stay limit” style rules.
 """
-)
 
 max_days_365 = 0
 window_start = None
 window_end = None
 
 if valid_intervals:
-    # Collect all dates you were in Japan
-    all_days = []
-    for s, e in valid_intervals:
-        delta = (e - s).days
-        for d in range(delta + 1):
-            all_days.append(s + timedelta(days=d))
-
-    all_days = sorted(set(all_days))  # Remove duplicates & sort
-
-    if all_days:
-        # Sliding window calculation for any 365-day period
-        i = 0
-        j = 0
-        n = len(all_days)
-        max_i = 0
-        max_j = 0
-
-        while i < n:
-            while j < n and (all_days[j] - all_days[i]) <= timedelta(days=364):
-                j += 1
-            window_size = j - i
-            if window_size > max_days_365:
-                max_days_365 = window_size
-                max_i = i
-                max_j = j - 1
-            i += 1
-
-        window_start = all_days[max_i]
-        window_end = all_days[max_j]
-
-        st.markdown(
-            f"""
-### 🔍 Rolling 365-day Result
+    # Recompute only when the interval set actually changed; checkbox and
+    # limit-input reruns reuse the results stashed in session state.
+    trip_key = tuple(sorted(valid_intervals))
+    if st.session_state.get("trip_key") != trip_key:
+        max_days, ws_ord, we_ord = rolling_365(trip_key)
+        st.session_state.update(
+            trip_key=trip_key,
+            max_days_365=max_days,
+            window_start=date.fromordinal(ws_ord),
+            window_end=date.fromordinal(we_ord),
+        )
+    max_days_365 = st.session_state["max_days_365"]
+    window_start = st.session_state["window_start"]
+    window_end = st.session_state["window_end"]
+
+    st.markdown(
+        section5_md
+        + f"""
+#### 🔍 Rolling 365-day Result
 
 - Maximum days stayed in any 365-day period:  
   👉 **{max_days_365} days**
@@ -188,59 +269,73 @@ if valid_intervals:
 
 (These dates mark the "densest" 365-day period of your Japan stay.)
 """
-        )
+    )
 
-        # Optional custom rolling limit check
-        rolling_limit_enable = st.checkbox("Enable custom rolling 365-day limit check", value=False)
-        if rolling_limit_enable:
-            rolling_limit_days = st.number_input("Set rolling 365-day limit", min_value=1, max_value=365, value=180)
-            if max_days_365 > rolling_limit_days:
-                st.error(
-                    f"⚠ You exceeded the custom rolling limit: {max_days_365} days > allowed {rolling_limit_days} days."
-                )
-            else:
-                st.success(
-                    f"✅ Maximum 365-day stay is {max_days_365} days, within the limit of {rolling_limit_days} days."
-                )
-    else:
-        st.info("No valid stay dates available for rolling calculation.")
+    # Optional custom rolling limit check
+    rolling_limit_enable = st.checkbox("Enable custom rolling 365-day limit check", value=False)
+    if rolling_limit_enable:
+        rolling_limit_days = st.number_input("Set rolling 365-day limit", min_value=1, max_value=365, value=180)
+        if max_days_365 > rolling_limit_days:
+            st.error(
+                f"⚠ You exceeded the custom rolling limit: {max_days_365} days > allowed {rolling_limit_days} days."
+            )
+        else:
+            st.success(
+                f"✅ Maximum 365-day stay is {max_days_365} days, within the limit of {rolling_limit_days} days."
+            )
 else:
+    st.markdown(section5_md)
     st.info("No valid entry/exit ranges entered.")
 
 # ---------------------------------------------
-# 6️⃣ Auto-check against Japan-style 90-day & 180-day rules
+# 4️⃣ + 6️⃣ Threshold checks (custom annual limit & Japan-style rules)
 # ---------------------------------------------
 st.markdown("---")
-st.subheader("6️⃣ Auto Check: 90-day Short Stay & 180-day Rolling Rule")
 
-st.caption(
-    """
+# One collapsed expander for both check sections: Streamlit batches the
+# contents, so the elements are not rendered until it is opened.
+with st.expander("Threshold checks (custom annual limit & auto rules)", expanded=False):
+    st.markdown("#### 4️⃣ Annual Threshold Check (Optional)")
+
+    limit_enable = st.checkbox("Enable custom annual stay limit (e.g., 180 days)", value=False)
+
+    if limit_enable:
+        limit_days = st.number_input("Set annual limit", min_value=1, max_value=365, value=180)
+        if total_days > limit_days:
+            st.error(f"⚠ Your stay of {total_days} days exceeds the annual limit of {limit_days}!")
+        else:
+            st.success(f"✅ Your stay of {total_days} days is within the annual limit of {limit_days}.")
+
+    st.markdown("#### 6️⃣ Auto Check: 90-day Short Stay & 180-day Rolling Rule")
+
+    st.caption(
+        """
 This section automatically evaluates your input against two common constraints:
 - **90-day limit per continuous stay** (each single visit should not exceed 90 days).
 - **180-day limit within any 365 days** (total days in Japan in any 12-month window).
 These are modeled as generic rules for your convenience; real legal rules may differ.
 """
-)
+    )
 
-# 90-day rule: per continuous stay
-if longest_single_stay == 0:
-    st.info("No valid stays to check for the 90-day rule.")
-else:
-    st.markdown(f"- Longest single continuous stay: **{longest_single_stay} days**")
-    if longest_single_stay > 90:
-        st.error("⚠ This exceeds a 90-day short-stay limit per visit.")
+    # 90-day rule: per continuous stay
+    if longest_single_stay == 0:
+        st.info("No valid stays to check for the 90-day rule.")
     else:
-        st.success("✅ All continuous stays are within a 90-day per-visit limit.")
+        st.markdown(f"- Longest single continuous stay: **{longest_single_stay} days**")
+        if longest_single_stay > 90:
+            st.error("⚠ This exceeds a 90-day short-stay limit per visit.")
+        else:
+            st.success("✅ All continuous stays are within a 90-day per-visit limit.")
 
-# 180-day rule: within any rolling 365 days
-if max_days_365 == 0:
-    st.info("Rolling 365-day data is not available yet (no valid stays).")
-else:
-    st.markdown(f"- Maximum days in any 365-day period: **{max_days_365} days**")
-    if max_days_365 > 180:
-        st.error("⚠ This exceeds a 180-day limit within a 365-day rolling window.")
+    # 180-day rule: within any rolling 365 days
+    if max_days_365 == 0:
+        st.info("Rolling 365-day data is not available yet (no valid stays).")
     else:
-        st.success("✅ Your maximum 365-day stay is within a 180-day rolling limit.")
+        st.markdown(f"- Maximum days in any 365-day period: **{max_days_365} days**")
+        if max_days_365 > 180:
+            st.error("⚠ This exceeds a 180-day limit within a 365-day rolling window.")
+        else:
+            st.success("✅ Your maximum 365-day stay is within a 180-day rolling limit.")
 
 st.info(
     """
@@ -252,5 +347,3 @@ st.info(
   - Different pre-set profiles for various visa types
 """
 )
-
-)